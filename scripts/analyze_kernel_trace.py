@@ -23,31 +23,161 @@ Behavior:
       3) CU_Utilization = min(Total_Workgroups / Number_of_CUs, 1.0) * 100
 
 Output:
-  - For each subfolder containing *_kernel_trace.csv (e.g., bel-phx4), writes a file:
+  - All rows of all variants are written to a single zstd-compressed file, <root>/combined.parquet, with fixed
+    column types (ids, timestamps and sizes as int64, metrics as float64). Besides variant_dir, p, ub, b and
+    csv_path, the categorical columns variant_name and subdir identify where each row came from, so later
+    steps can simply group by them; Kernel_Name is categorical as well.
+  - <root>/combined.cache.json records the (mtime, size, hash of the first 4 KiB) of every trace behind each
+    subfolder's rows, and how many rows that is. On a rerun with the same --cus and --match-substring, the
+    rows of subfolders whose traces are all unchanged are copied over from the previous combined.parquet
+    instead of being recomputed, provided it still holds that many rows for them (use --force to recompute
+    everything). combined.parquet is only replaced once a run completes; an interrupted run leaves the
+    previous one in place.
+  - With --legacy-csv, writes the CSV layout of earlier versions of this script instead: for each subfolder
+    containing *_kernel_trace.csv (e.g., bel-phx4), a file
       <subfolder>/<variant_name>.csv
     Example:
       Input:  .../p2048_ub512_b512/bel-phx4/16880_kernel_trace.csv
       Output: .../p2048_ub512_b512/bel-phx4/p2048_ub512_b512.csv
+    plus all of their rows in <root>/combined.csv, with the unchanged-trace cache kept per subfolder in
+    <subfolder>/<variant_name>.cache.json.
 
 Usage:
   python scripts/analyze_kernel_traces.py --cus 136 --root /path/to/prof_dir/20251001_150115
   python scripts/analyze_kernel_traces.py -c 136 -r /home/aamarnat/projects/ROCr_AIE/llama.cpp_gold/prof_dir/20251001_150115
 
 Notes:
-  - This script streams CSVs and performs two passes per file to avoid loading large files into memory.
+  - Each CSV is loaded once with the Arrow CSV reader (only the columns above), and the halfway point is
+    found with a vectorized substring search over Kernel_Name.
+  - With --stream, the trace is memory-mapped: a compiled byte pattern finds the candidate lines, of which
+    only those whose Kernel_Name field contains the substring are counted, and a backward search from EOF
+    finds the halfway one. Only the rows from there on are parsed, with the csv module in fixed-size
+    chunks, so memory use does not grow with the trace size.
+  - Traces are parsed in parallel by a pool of --jobs worker processes (default: one per CPU).
+  - If numba is installed, the per-row metric arithmetic runs in a JIT-compiled kernel.
   - If no 'rms_norm_f32' is found in a file, that file is skipped with a warning to stderr.
 """
 
 import argparse
+import contextlib
 import csv
-import glob
+import functools
+import hashlib
+import io
+import json
+import mmap
+import operator
 import os
 import re
+import shutil
 import sys
-from typing import Dict, Iterator, List, Tuple
-
-
-VARIANT_DIR_RE = re.compile(r"^p(?P<p>\d+)_ub(?P<ub>\d+)_b(?P<b>\d+)$")
+from multiprocessing import Pool
+from typing import IO, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+try:
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError as e:
+    print("the following Python libraries are required: numpy, pandas, pyarrow.", file=sys.stderr)
+    raise e
+
+try:
+    import numba
+except ImportError:
+    numba = None  # optional: compute_metrics falls back to NumPy ufuncs
+
+
+# Bytes hashed from the start of each trace for the output cache signature
+CACHE_HEAD_BYTES = 4096
+
+# Rows per DataFrame chunk when streaming traces with --stream
+STREAM_CHUNK_ROWS = 1 << 16
+
+# Trace columns consumed from each *_kernel_trace.csv
+TRACE_COLUMNS = [
+    "Dispatch_Id",
+    "Kernel_Id",
+    "Kernel_Name",
+    "Start_Timestamp",
+    "End_Timestamp",
+    "Workgroup_Size_X",
+    "Workgroup_Size_Y",
+    "Workgroup_Size_Z",
+    "Grid_Size_X",
+    "Grid_Size_Y",
+    "Grid_Size_Z",
+]
+
+# Numeric trace columns that feed compute_metrics, in its unpacking order
+METRIC_INPUT_COLUMNS = [
+    "Start_Timestamp",
+    "End_Timestamp",
+    "Workgroup_Size_X",
+    "Workgroup_Size_Y",
+    "Workgroup_Size_Z",
+    "Grid_Size_X",
+    "Grid_Size_Y",
+    "Grid_Size_Z",
+]
+
+# Columns written to each <variant_name>.csv
+OUTPUT_COLUMNS = [
+    "variant_dir",
+    "p",
+    "ub",
+    "b",
+    "csv_path",
+    "Dispatch_Id",
+    "Kernel_Id",
+    "Kernel_Name",
+    "Start_Timestamp",
+    "End_Timestamp",
+    "time_us",
+    "Workgroup_Size_X",
+    "Workgroup_Size_Y",
+    "Workgroup_Size_Z",
+    "Grid_Size_X",
+    "Grid_Size_Y",
+    "Grid_Size_Z",
+    "Total_Workgroups",
+    "CU_Utilization_pct",
+]
+OUTPUT_HEADER = ",".join(OUTPUT_COLUMNS) + "\n"
+
+# Column types of combined.parquet: OUTPUT_COLUMNS, then the categorical provenance columns
+OUTPUT_SCHEMA = pa.schema([
+    ("variant_dir", pa.string()),
+    ("p", pa.int64()),
+    ("ub", pa.int64()),
+    ("b", pa.int64()),
+    ("csv_path", pa.string()),
+    ("Dispatch_Id", pa.int64()),
+    ("Kernel_Id", pa.int64()),
+    ("Kernel_Name", pa.dictionary(pa.int32(), pa.string())),
+    ("Start_Timestamp", pa.int64()),
+    ("End_Timestamp", pa.int64()),
+    ("time_us", pa.float64()),
+    ("Workgroup_Size_X", pa.int64()),
+    ("Workgroup_Size_Y", pa.int64()),
+    ("Workgroup_Size_Z", pa.int64()),
+    ("Grid_Size_X", pa.int64()),
+    ("Grid_Size_Y", pa.int64()),
+    ("Grid_Size_Z", pa.int64()),
+    ("Total_Workgroups", pa.float64()),
+    ("CU_Utilization_pct", pa.float64()),
+    ("variant_name", pa.dictionary(pa.int32(), pa.string())),
+    ("subdir", pa.dictionary(pa.int32(), pa.string())),
+])
+
+# A block of output rows: CSV text for --legacy-csv, otherwise an Arrow table
+OutputBlock = Union[str, pa.Table]
+
+# Write buffer for output files; large enough that rows reach the OS in few, big writes
+OUTPUT_BUFFER_BYTES = 1 << 20
 
 
 def parse_args() -> argparse.Namespace:
@@ -60,20 +190,55 @@ def parse_args() -> argparse.Namespace:
         default="rms_norm_f32",
         help="Substring in Kernel_Name to identify occurrences for halfway point (default: rms_norm_f32)",
     )
+    p.add_argument(
+        "--legacy-csv",
+        action="store_true",
+        help="Write per-subfolder <variant_name>.csv files and combined.csv instead of combined.parquet",
+    )
+    p.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream each trace in fixed-size chunks instead of loading it whole (for traces larger than RAM)",
+    )
+    p.add_argument(
+        "--force",
+        action="store_true",
+        help="Rewrite every output even if its traces are unchanged since the last run",
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for parsing traces (default: CPU count; ignored with --stream)",
+    )
     return p.parse_args()
 
 
-def safe_float(v: str, default: float = 0.0) -> float:
-    try:
-        return float(v)
-    except Exception:
-        return default
+def parse_variant_dir_name(name: str) -> Optional[Tuple[int, int, int]]:
+    """Return (p, ub, b) if name is exactly p<p>_ub<ub>_b<b> with decimal p, ub and b, else None."""
+    if not name.startswith("p"):
+        return None
+    parts = name.split("_")
+    if len(parts) != 3 or not parts[1].startswith("ub") or not parts[2].startswith("b"):
+        return None
+    values = (parts[0][1:], parts[1][2:], parts[2][1:])
+    if not all(v.isdecimal() for v in values):
+        return None
+    p, ub, b = (int(v) for v in values)
+    return p, ub, b
 
 
 def iter_variant_dirs(root: str) -> Iterator[Tuple[str, int, int, int]]:
     """Yield (path, p, ub, b) for subdirectories matching p<p>_ub<ub>_b<b>."""
+    entries = []
     try:
-        entries = os.listdir(root)
+        with os.scandir(root) as it:
+            for e in it:
+                # Parse the name first; it is cheaper than is_dir() and rejects most unrelated entries
+                parsed = parse_variant_dir_name(e.name)
+                if parsed is not None and e.is_dir():
+                    entries.append((e.name, e.path, parsed))
     except FileNotFoundError:
         print(f"ERROR: root path not found: {root}", file=sys.stderr)
         return
@@ -81,75 +246,350 @@ def iter_variant_dirs(root: str) -> Iterator[Tuple[str, int, int, int]]:
         print(f"ERROR: failed to list root '{root}': {e}", file=sys.stderr)
         return
 
-    for name in sorted(entries):
-        full = os.path.join(root, name)
-        if not os.path.isdir(full):
-            continue
-        m = VARIANT_DIR_RE.match(name)
-        if m:
-            p = int(m.group("p"))
-            ub = int(m.group("ub"))
-            b = int(m.group("b"))
-            yield full, p, ub, b
+    for _, full, (p, ub, b) in sorted(entries):
+        yield full, p, ub, b
 
 
-def count_occurrences(csv_path: str, kernel_col: str, match_substring: str) -> int:
+def load_rows_from_half(csv_path: str, kernel_col: str, match_substring: str) -> Optional[pd.DataFrame]:
+    """
+    Read the trace columns of interest with the (multithreaded) Arrow CSV reader and return
+    the rows from the halfway occurrence of match_substring onward, or None if it never occurs.
+    Only the selected rows are converted to pandas.
+    """
+    tbl = pacsv.read_csv(
+        csv_path,
+        convert_options=pacsv.ConvertOptions(include_columns=TRACE_COLUMNS, column_types={kernel_col: pa.string()}),
+    )
+    mask = pc.fill_null(pc.match_substring(tbl[kernel_col], match_substring), False)
+    idxs = pc.indices_nonzero(mask)
+    if len(idxs) == 0:
+        return None
+    start_row = idxs[len(idxs) // 2].as_py()
+    # Nullable Int64 keeps integer columns with blank cells integral (plain to_pandas would make them float64,
+    # turning "4" into "4.0" in the CSV output and rounding nanosecond timestamps)
+    return tbl.slice(start_row).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+
+def read_header(f: IO[bytes], csv_path: str, kernel_col: str) -> List[str]:
+    """Parse the header line of a trace opened in binary mode, leaving f at the first data row."""
+    header = next(csv.reader([f.readline().decode("utf-8")]), [])
+    if kernel_col not in header:
+        raise KeyError(f"Kernel column '{kernel_col}' not found in {csv_path}. Headers: {header}")
+    return header
+
+
+@functools.lru_cache(maxsize=None)
+def needle_pattern(match_substring: str) -> "re.Pattern[bytes]":
+    """Compiled byte pattern for match_substring, built once per process and shared by all traces."""
+    return re.compile(re.escape(match_substring.encode("utf-8")))
+
+
+def kernel_field_matches(line: bytes, kernel_idx: int, match_substring: str) -> bool:
+    """Whether the field at kernel_idx of one raw trace line contains match_substring."""
+    row = next(csv.reader([line.decode("utf-8", errors="replace")]), [])
+    return kernel_idx < len(row) and match_substring in row[kernel_idx]
+
+
+def count_occurrences(mm: mmap.mmap, data_start: int, kernel_idx: int, match_substring: str) -> int:
+    """
+    Count the rows of a memory-mapped trace whose Kernel_Name (field kernel_idx) contains match_substring.
+    The byte pattern is only a prefilter: a line is decoded and split only when it contains the substring
+    somewhere, and then counted only if the match is in its Kernel_Name field.
+    """
+    needle_re = needle_pattern(match_substring)
     count = 0
-    with open(csv_path, "r", newline="") as f:
-        reader = csv.DictReader(f)
-        if not reader.fieldnames or kernel_col not in reader.fieldnames:
-            raise KeyError(f"Kernel column '{kernel_col}' not found in {csv_path}. Headers: {reader.fieldnames}")
-        for row in reader:
-            if match_substring in (row.get(kernel_col) or ""):
-                count += 1
-    return count
-
-
-def process_rows_from_half(csv_path: str, start_occurrence_0based: int, kernel_col: str, match_substring: str) -> Iterator[Dict[str, str]]:
-    """Yield rows (as dicts) from the selected occurrence onward."""
-    occ_index = 0
-    started = False
-    with open(csv_path, "r", newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if match_substring in (row.get(kernel_col) or ""):
-                if occ_index == start_occurrence_0based:
-                    started = True
-                occ_index += 1
-            if started:
-                yield row
-
-
-def compute_metrics(row: Dict[str, str], num_cus: int) -> Tuple[float, float, float]:
-    """
-    Returns (time_us, total_workgroups, cu_utilization_pct)
-    """
-    start_ts = safe_float(row.get("Start_Timestamp", "0"), 0.0)
-    end_ts = safe_float(row.get("End_Timestamp", "0"), 0.0)
-    time_us = (end_ts - start_ts) / 1000.0
+    pos = data_start
+    while True:
+        m = needle_re.search(mm, pos)
+        if m is None:
+            return count
+        nl = mm.rfind(b"\n", data_start, m.start())
+        line_start = data_start if nl < 0 else nl + 1
+        eol = mm.find(b"\n", m.end())
+        line_end = len(mm) if eol < 0 else eol + 1
+        if kernel_field_matches(mm[line_start:line_end], kernel_idx, match_substring):
+            count += 1
+        if eol < 0:
+            return count
+        pos = line_end
+
+
+def find_line_from_end(
+    mm: mmap.mmap, data_start: int, kernel_idx: int, match_substring: str, nth_from_end: int
+) -> Optional[int]:
+    """
+    Return the byte offset of the nth_from_end-th last line (1-based) whose Kernel_Name (field kernel_idx)
+    contains match_substring, searching the memory-mapped trace backward from EOF and never before
+    data_start. None if there are fewer. Candidate lines are found on the raw bytes, as in count_occurrences.
+    """
+    needle = match_substring.encode("utf-8")
+    pos = len(mm)
+    found = 0
+    while True:
+        i = mm.rfind(needle, data_start, pos)
+        if i < 0:
+            return None
+        nl = mm.rfind(b"\n", data_start, i)
+        line_start = data_start if nl < 0 else nl + 1
+        eol = mm.find(b"\n", i + len(needle))
+        line_end = len(mm) if eol < 0 else eol + 1
+        if kernel_field_matches(mm[line_start:line_end], kernel_idx, match_substring):
+            found += 1
+            if found == nth_from_end:
+                return line_start
+        # An empty needle matches at pos itself, so step back at least one byte to always make progress
+        pos = line_start if line_start < pos else pos - 1
+
+
+def locate_half_offset(csv_path: str, kernel_col: str, match_substring: str) -> Optional[int]:
+    """
+    Byte offset of the row holding the halfway occurrence (zero-based index N//2 of N), or None if there
+    are none. The trace is memory-mapped: the count needs one forward search, and the row itself is then
+    found by searching back from EOF, which only touches the tail that is about to be parsed anyway.
+    """
+    with open(csv_path, "rb") as f:
+        kernel_idx = read_header(f, csv_path, kernel_col).index(kernel_col)
+        data_start = f.tell()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            total_occ = count_occurrences(mm, data_start, kernel_idx, match_substring)
+            if total_occ == 0:
+                return None
+            return find_line_from_end(mm, data_start, kernel_idx, match_substring, total_occ - total_occ // 2)
+
+
+def iter_chunks_from_offset(csv_path: str, offset: int, kernel_col: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Yield the trace columns, chunk_rows rows at a time, from the row starting at byte offset onward."""
+    buf: List[Tuple[str, ...]] = []
+    with open(csv_path, "rb") as f:
+        header = read_header(f, csv_path, kernel_col)
+        missing = [col for col in TRACE_COLUMNS if col not in header]
+        if missing:
+            raise KeyError(f"Columns {missing} not found in {csv_path}. Headers: {header}")
+        # Column positions are resolved once from the header; rows are plain lists, not dicts
+        pick = operator.itemgetter(*(header.index(col) for col in TRACE_COLUMNS))
+        width = len(header)
+        f.seek(offset)
+        for row in csv.reader(io.TextIOWrapper(f, encoding="utf-8", newline="")):
+            if not row:
+                continue  # blank line, skipped like csv.DictReader does
+            if len(row) < width:
+                row += [""] * (width - len(row))
+            buf.append(pick(row))
+            if len(buf) == chunk_rows:
+                yield pd.DataFrame.from_records(buf, columns=TRACE_COLUMNS)
+                buf = []
+    if buf:
+        yield pd.DataFrame.from_records(buf, columns=TRACE_COLUMNS)
+
+
+def stream_rows_from_half(
+    csv_path: str, kernel_col: str, match_substring: str, chunk_rows: int
+) -> Optional[Iterator[pd.DataFrame]]:
+    """
+    Streaming counterpart of load_rows_from_half for traces that do not fit in memory: the halfway row is
+    located on the raw bytes, then the rows from it onward are yielded in chunks.
+    Returns None if match_substring never occurs.
+    """
+    offset = locate_half_offset(csv_path, kernel_col, match_substring)
+    if offset is None:
+        return None
+    return iter_chunks_from_offset(csv_path, offset, kernel_col, chunk_rows)
 
-    wsx = max(safe_float(row.get("Workgroup_Size_X", "0"), 0.0), 1.0)
-    wsy = max(safe_float(row.get("Workgroup_Size_Y", "0"), 0.0), 1.0)
-    wsz = max(safe_float(row.get("Workgroup_Size_Z", "0"), 0.0), 1.0)
 
-    gsx = safe_float(row.get("Grid_Size_X", "0"), 0.0)
-    gsy = safe_float(row.get("Grid_Size_Y", "0"), 0.0)
-    gsz = safe_float(row.get("Grid_Size_Z", "0"), 0.0)
+if numba is not None:
+    @numba.njit(cache=True, fastmath=True)
+    def _metrics_kernel(start_ts, end_ts, wsx, wsy, wsz, gsx, gsy, gsz, num_cus, out_time_us, out_total_wg, out_cu_util):
+        for i in range(start_ts.shape[0]):
+            out_time_us[i] = (end_ts[i] - start_ts[i]) / 1000.0
+            total_wg = (gsx[i] / max(wsx[i], 1.0)) * (gsy[i] / max(wsy[i], 1.0)) * (gsz[i] / max(wsz[i], 1.0))
+            out_total_wg[i] = total_wg
+            out_cu_util[i] = min(total_wg / num_cus, 1.0) * 100.0 if num_cus > 0 else 0.0
+
+
+def to_float64(values: pd.Series) -> np.ndarray:
+    """Parse a whole column to float64 in one batch; missing or malformed cells become 0."""
+    return pd.to_numeric(values, errors="coerce").fillna(0.0).to_numpy(dtype=np.float64)
+
+
+def compute_metrics(rows: pd.DataFrame, num_cus: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns (time_us, total_workgroups, cu_utilization_pct) as arrays with one entry per row.
+    Missing or non-numeric cells are treated as 0. Uses a numba kernel when numba is installed.
+    """
+    start_ts, end_ts, wsx, wsy, wsz, gsx, gsy, gsz = (to_float64(rows[col]) for col in METRIC_INPUT_COLUMNS)
+
+    if numba is not None:
+        time_us = np.empty_like(start_ts)
+        total_workgroups = np.empty_like(start_ts)
+        cu_utilization = np.empty_like(start_ts)
+        _metrics_kernel(start_ts, end_ts, wsx, wsy, wsz, gsx, gsy, gsz, float(num_cus), time_us, total_workgroups, cu_utilization)
+        return time_us, total_workgroups, cu_utilization
 
+    time_us = (end_ts - start_ts) / 1000.0
+    wsx, wsy, wsz = np.maximum(wsx, 1.0), np.maximum(wsy, 1.0), np.maximum(wsz, 1.0)
     total_workgroups = (gsx / wsx) * (gsy / wsy) * (gsz / wsz)
 
     if num_cus <= 0:
-        cu_utilization = 0.0
+        cu_utilization = np.zeros_like(total_workgroups)
     else:
-        cu_utilization = min(total_workgroups / float(num_cus), 1.0) * 100.0
+        cu_utilization = np.minimum(total_workgroups / float(num_cus), 1.0) * 100.0
 
     return time_us, total_workgroups, cu_utilization
 
 
+def build_output_frame(rows: pd.DataFrame, vdir: str, p: int, ub: int, b: int, csv_path: str, num_cus: int) -> pd.DataFrame:
+    """Attach provenance and computed metrics to the selected trace rows, in OUTPUT_COLUMNS order."""
+    time_us, total_wg, cu_util_pct = compute_metrics(rows, num_cus)
+    out = rows.assign(
+        variant_dir=vdir,
+        p=p,
+        ub=ub,
+        b=b,
+        csv_path=csv_path,
+        time_us=time_us,
+        Total_Workgroups=total_wg,
+        CU_Utilization_pct=cu_util_pct,
+    )
+    return out[OUTPUT_COLUMNS]
+
+
+def encode_block(out: pd.DataFrame, legacy_csv: bool) -> OutputBlock:
+    """
+    Encode the output frame of one trace (or chunk) for the output in use: CSV text with the metric columns
+    rounded to their precision, or an Arrow table with the OUTPUT_SCHEMA types (malformed numeric cells become
+    null) and the variant_name and subdir columns added.
+    """
+    if legacy_csv:
+        # Round as whole columns and let to_csv format the floats, instead of formatting cell by cell
+        out = out.assign(
+            time_us=out["time_us"].round(3),
+            Total_Workgroups=out["Total_Workgroups"].round(6),
+            CU_Utilization_pct=out["CU_Utilization_pct"].round(2),
+        )
+        return out.to_csv(header=False, index=False)
+
+    typed = {}
+    for name in OUTPUT_COLUMNS:
+        field = OUTPUT_SCHEMA.field(name)
+        col = out[name]
+        if pa.types.is_dictionary(field.type):
+            typed[name] = pa.array(col, type=pa.string(), from_pandas=True).dictionary_encode()
+            continue
+        if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            col = pd.to_numeric(col, errors="coerce")
+        typed[name] = pa.array(col, type=field.type, from_pandas=True)
+
+    # One block always comes from a single trace, so both provenance columns are constant
+    zeros = pa.array(np.zeros(len(out), dtype=np.int32))
+    csv_path = out["csv_path"].iloc[0] if len(out) else ""
+    variant_dir = out["variant_dir"].iloc[0] if len(out) else ""
+    typed["variant_name"] = pa.DictionaryArray.from_arrays(zeros, pa.array([os.path.basename(variant_dir)]))
+    typed["subdir"] = pa.DictionaryArray.from_arrays(zeros, pa.array([os.path.dirname(csv_path)]))
+    return pa.Table.from_pydict(typed, schema=OUTPUT_SCHEMA)
+
+
+class CsvOutput:
+    """CSV output file: header written once, rows appended as pre-formatted text through a large buffer."""
+
+    def __init__(self, path: str):
+        self.f = open(path, "w", newline="", buffering=OUTPUT_BUFFER_BYTES)
+        self.f.write(OUTPUT_HEADER)
+
+    def write(self, blocks: List[OutputBlock]) -> None:
+        self.f.write("".join(blocks))
+
+    def append_file(self, path: str) -> None:
+        """Append the rows of an existing output of the same format."""
+        with open(path, "r", newline="") as f:
+            f.readline()
+            shutil.copyfileobj(f, self.f, OUTPUT_BUFFER_BYTES)
+
+    def close(self) -> None:
+        self.f.close()
+
+    def __enter__(self) -> "CsvOutput":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class ParquetOutput:
+    """
+    Parquet output file with the OUTPUT_SCHEMA types; each write() becomes one row group (up to 1M rows).
+    It is written to a temporary file that replaces path only when the output is closed without an error
+    (when used as a context manager, only if the block exits cleanly), so the previous version stays
+    readable (and reusable) until then, and after a failed or interrupted run.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.writer = pq.ParquetWriter(path + ".tmp", OUTPUT_SCHEMA, compression="zstd")
+
+    def write(self, blocks: List[OutputBlock]) -> None:
+        # concat_tables only stitches the column chunks together; nothing is copied
+        self.writer.write_table(pa.concat_tables(blocks))
+
+    def close(self) -> None:
+        self.writer.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def discard(self) -> None:
+        """Drop the rows written so far and leave path untouched."""
+        self.writer.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path + ".tmp")
+
+    def __enter__(self) -> "ParquetOutput":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def read_previous_rows(path: str) -> Optional[Dict[str, pa.Table]]:
+    """
+    Rows of a previous combined.parquet for reuse, split by subdir (in their original order), or None if it is
+    missing or unreadable. The table is grouped once, by a stable sort on the subdir codes, so picking out
+    the rows of a subfolder afterwards is a zero-copy slice.
+    """
+    try:
+        rows = pq.read_table(path, schema=OUTPUT_SCHEMA)
+        subdirs = rows["subdir"].cast(pa.string()).combine_chunks().dictionary_encode()
+        codes = subdirs.indices.to_numpy(zero_copy_only=False)
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(subdirs.dictionary))
+        starts = np.cumsum(counts) - counts
+        grouped = rows.take(pa.array(order))
+    except Exception:
+        return None
+    return {
+        subdir: grouped.slice(start, count)
+        for subdir, start, count in zip(subdirs.dictionary.to_pylist(), starts.tolist(), counts.tolist())
+    }
+
+
 def find_csvs(variant_dir: str) -> List[str]:
-    # Pattern: <variant_dir>/*/*_kernel_trace.csv
-    pattern = os.path.join(variant_dir, "*", "*_kernel_trace.csv")
-    files = sorted(glob.glob(pattern))
+    # Pattern: <variant_dir>/*/*_kernel_trace.csv (hidden entries skipped, as glob would)
+    files = []
+    try:
+        with os.scandir(variant_dir) as subdirs:
+            sub_paths = [sub.path for sub in subdirs if not sub.name.startswith(".") and sub.is_dir()]
+    except OSError as e:
+        print(f"WARNING: cannot list '{variant_dir}': {e}", file=sys.stderr)
+        return files
+    for sub_path in sub_paths:
+        try:
+            with os.scandir(sub_path) as it:
+                for e in it:
+                    if e.name.endswith("_kernel_trace.csv") and not e.name.startswith("."):
+                        files.append(e.path)
+        except OSError as e:
+            print(f"WARNING: cannot list '{sub_path}': {e}", file=sys.stderr)
+    files.sort()
     return files
 
 
@@ -161,12 +601,95 @@ def group_csvs_by_subdir(csv_paths: List[str]) -> Dict[str, List[str]]:
     return groups
 
 
+def file_signature(path: str) -> List:
+    """(mtime_ns, size, sha256 of the first CACHE_HEAD_BYTES) identifying the current contents of path."""
+    st = os.stat(path)
+    with open(path, "rb") as f:
+        head = hashlib.sha256(f.read(CACHE_HEAD_BYTES)).hexdigest()
+    return [st.st_mtime_ns, st.st_size, head]
+
+
+def load_cache(cache_path: str) -> Dict:
+    try:
+        with open(cache_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache_path: str, cache: Dict) -> None:
+    """Write cache_path atomically, so an interrupted run never leaves a half-written cache behind."""
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, cache_path)
+
+
+def process_trace(
+    csv_path: str, vdir: str, p: int, ub: int, b: int, args: argparse.Namespace, emit: Callable[[OutputBlock], None]
+) -> bool:
+    """
+    Pass the output rows of one trace to emit, encoded for the output in use, one block per chunk.
+    Returns True if the trace was processed without error.
+    """
+    try:
+        if args.stream:
+            chunks = stream_rows_from_half(csv_path, "Kernel_Name", args.match_substring, STREAM_CHUNK_ROWS)
+        else:
+            rows = load_rows_from_half(csv_path, "Kernel_Name", args.match_substring)
+            chunks = None if rows is None else iter([rows])
+    except Exception as e:
+        print(f"ERROR: failed reading {csv_path}: {e}", file=sys.stderr)
+        return False
+
+    if chunks is None:
+        print(f"WARNING: no occurrences of '{args.match_substring}' in {csv_path}; skipping", file=sys.stderr)
+        return True
+
+    try:
+        for rows in chunks:
+            emit(encode_block(build_output_frame(rows, vdir, p, ub, b, csv_path, args.cus), args.legacy_csv))
+    except Exception as e:
+        print(f"ERROR: processing {csv_path}: {e}", file=sys.stderr)
+        return False
+    return True
+
+
+def process_trace_worker(task: Tuple[str, str, int, int, int, argparse.Namespace]) -> Tuple[List[OutputBlock], bool]:
+    """Pool entry point: process_trace with the output blocks collected and returned to the parent."""
+    blocks: List[OutputBlock] = []
+    ok = process_trace(*task, emit=blocks.append)
+    return blocks, ok
+
+
+class PlannedOutput(NamedTuple):
+    """One (variant, subfolder) output: where its rows come from and go to, and whether they can be reused."""
+
+    vdir: str
+    p: int
+    ub: int
+    b: int
+    subdir: str
+    files: List[str]
+    out_path: str
+    cache_path: str
+    cache: Dict
+    up_to_date: bool
+
+
 def main() -> None:
     args = parse_args()
     root = args.root
     num_cus = args.cus
     match_substring = args.match_substring
 
+    combined_path = os.path.join(root, "combined.csv" if args.legacy_csv else "combined.parquet")
+    combined_cache_path = os.path.join(root, "combined.cache.json")
+    combined_cache = {} if args.legacy_csv else load_cache(combined_cache_path)
+    previous_rows = None if args.legacy_csv or args.force else read_previous_rows(combined_path)
+
+    # Plan every (variant, subfolder) output first, so the traces that need parsing can be handed to a pool
+    plan: List[PlannedOutput] = []
     for vdir, p, ub, b in iter_variant_dirs(root):
         csv_paths = find_csvs(vdir)
         if not csv_paths:
@@ -178,76 +701,122 @@ def main() -> None:
 
         for subdir, files in groups.items():
             out_path = os.path.join(subdir, f"{variant_name}.csv")
+            cache_path = os.path.join(subdir, f"{variant_name}.cache.json")
             try:
-                with open(out_path, "w", newline="") as out_f:
-                    out_writer = csv.writer(out_f)
-                    # Output CSV header
-                    out_writer.writerow([
-                        "variant_dir",
-                        "p",
-                        "ub",
-                        "b",
-                        "csv_path",
-                        "Dispatch_Id",
-                        "Kernel_Id",
-                        "Kernel_Name",
-                        "Start_Timestamp",
-                        "End_Timestamp",
-                        "time_us",
-                        "Workgroup_Size_X",
-                        "Workgroup_Size_Y",
-                        "Workgroup_Size_Z",
-                        "Grid_Size_X",
-                        "Grid_Size_Y",
-                        "Grid_Size_Z",
-                        "Total_Workgroups",
-                        "CU_Utilization_pct",
-                    ])
-
-                    for csv_path in files:
-                        try:
-                            # First pass: count occurrences of the kernel substring
-                            total_occ = count_occurrences(csv_path, "Kernel_Name", match_substring)
-                        except Exception as e:
-                            print(f"ERROR: failed counting occurrences in {csv_path}: {e}", file=sys.stderr)
-                            continue
-
-                        if total_occ == 0:
-                            print(f"WARNING: no occurrences of '{match_substring}' in {csv_path}; skipping", file=sys.stderr)
-                            continue
-
-                        start_occ_0 = total_occ // 2  # zero-based index to start from
-                        try:
-                            rows_iter = process_rows_from_half(csv_path, start_occ_0, "Kernel_Name", match_substring)
-                            for row in rows_iter:
-                                time_us, total_wg, cu_util_pct = compute_metrics(row, num_cus)
-                                out_writer.writerow([
-                                    vdir,
-                                    p,
-                                    ub,
-                                    b,
-                                    csv_path,
-                                    row.get("Dispatch_Id", ""),
-                                    row.get("Kernel_Id", ""),
-                                    row.get("Kernel_Name", ""),
-                                    row.get("Start_Timestamp", ""),
-                                    row.get("End_Timestamp", ""),
-                                    f"{time_us:.3f}",
-                                    row.get("Workgroup_Size_X", ""),
-                                    row.get("Workgroup_Size_Y", ""),
-                                    row.get("Workgroup_Size_Z", ""),
-                                    row.get("Grid_Size_X", ""),
-                                    row.get("Grid_Size_Y", ""),
-                                    row.get("Grid_Size_Z", ""),
-                                    f"{total_wg:.6f}",
-                                    f"{cu_util_pct:.2f}",
-                                ])
-                        except Exception as e:
-                            print(f"ERROR: processing {csv_path}: {e}", file=sys.stderr)
-                            continue
-            except Exception as e:
-                print(f"ERROR: cannot write output file '{out_path}': {e}", file=sys.stderr)
-                continue
+                signatures = {csv_path: file_signature(csv_path) for csv_path in files}
+            except OSError as e:
+                print(f"WARNING: cannot stat traces in {subdir}: {e}", file=sys.stderr)
+                signatures = None
+            cache = {"cus": num_cus, "match_substring": match_substring, "inputs": signatures}
+            if args.legacy_csv:
+                up_to_date = os.path.exists(out_path) and load_cache(cache_path) == cache
+            else:
+                # The cache also records how many rows the subfolder produced, so rows missing from the
+                # previous combined.parquet are regenerated rather than silently dropped
+                up_to_date = previous_rows is not None and combined_cache.get(subdir) == dict(
+                    cache, rows=previous_rows[subdir].num_rows if subdir in previous_rows else 0
+                )
+            up_to_date = up_to_date and not args.force and signatures is not None
+            plan.append(PlannedOutput(vdir, p, ub, b, subdir, files, out_path, cache_path, cache, up_to_date))
+
+    # Traces are parsed in parallel but their results consumed in plan order (Pool.imap keeps task order),
+    # so outputs are written exactly as in a serial run. --stream stays serial to keep memory bounded.
+    use_pool = not args.stream and args.jobs > 1
+    tasks = [
+        (csv_path, entry.vdir, entry.p, entry.ub, entry.b, args)
+        for entry in plan if not entry.up_to_date
+        for csv_path in entry.files
+    ]
+
+    try:
+        combined = CsvOutput(combined_path) if args.legacy_csv else ParquetOutput(combined_path)
+    except Exception as e:
+        print(f"ERROR: cannot write output file '{combined_path}': {e}", file=sys.stderr)
+        return
+
+    new_combined_cache = {}
+    # On an error or interrupt, combined.parquet is left as it was (ParquetOutput.__exit__) and the cache is not
+    # saved, so the next run still finds the previous rows and cache consistent with each other
+    with combined, (Pool(args.jobs) if use_pool and tasks else contextlib.nullcontext()) as pool:
+        results = pool.imap(process_trace_worker, tasks) if pool is not None else None
+
+        for entry in plan:
+            vdir, p, ub, b, subdir, files, out_path, cache_path, cache, up_to_date = entry
+            # Take this output's pool results before anything else, whichever path it then goes down, so
+            # the results iterator stays aligned with the plan
+            pooled_results = [next(results) for _ in files] if results is not None and not up_to_date else None
+            if up_to_date:
+                # Reuse the existing rows for the combined output
+                try:
+                    if args.legacy_csv:
+                        combined.append_file(out_path)
+                    else:
+                        reused = previous_rows.get(subdir)
+                        if reused is not None:
+                            combined.write([reused])
+                        new_combined_cache[subdir] = dict(cache, rows=0 if reused is None else reused.num_rows)
+                    continue
+                except Exception as e:
+                    print(f"WARNING: cannot reuse the rows of {subdir}, regenerating: {e}", file=sys.stderr)
+
+            out = None
+            if args.legacy_csv:
+                try:
+                    # Drop the old cache before truncating the output, so a run that fails part-way through
+                    # leaves the subfolder looking stale rather than up to date
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(cache_path)
+                    out = CsvOutput(out_path)
+                except Exception as e:
+                    print(f"ERROR: cannot write output file '{out_path}': {e}", file=sys.stderr)
+                    continue
+            outputs = [combined] if out is None else [out, combined]
+
+            # The blocks of a whole subfolder are collected (they are columnar already) and written once,
+            # except with --stream, where each chunk is written as soon as it is ready to bound memory use
+            blocks: List[OutputBlock] = []
+            rows_emitted = 0
+
+            def emit(block: OutputBlock) -> None:
+                nonlocal rows_emitted
+                if isinstance(block, pa.Table):
+                    rows_emitted += block.num_rows
+                if args.stream:
+                    for output in outputs:
+                        output.write([block])
+                else:
+                    blocks.append(block)
+
+            ok = True
+            with out if out is not None else contextlib.nullcontext():
+                for i, csv_path in enumerate(files):
+                    if pooled_results is not None:
+                        file_blocks, file_ok = pooled_results[i]
+                        for block in file_blocks:
+                            emit(block)
+                    else:
+                        file_ok = process_trace(csv_path, vdir, p, ub, b, args, emit)
+                    ok = ok and file_ok
+                if blocks:
+                    for output in outputs:
+                        output.write(blocks)
+
+            # Only remember outputs that are complete, so failed traces are retried next run
+            if ok and cache["inputs"] is not None:
+                if not args.legacy_csv:
+                    new_combined_cache[subdir] = dict(cache, rows=rows_emitted)
+                    continue
+                try:
+                    save_cache(cache_path, cache)
+                except OSError as e:
+                    print(f"WARNING: cannot write cache '{cache_path}': {e}", file=sys.stderr)
+
+    # combined.parquet is in place now (ParquetOutput.__exit__), so its cache can describe it
+    if not args.legacy_csv:
+        try:
+            save_cache(combined_cache_path, new_combined_cache)
+        except OSError as e:
+            print(f"WARNING: cannot write cache '{combined_cache_path}': {e}", file=sys.stderr)
 
 
 if __name__ == "__main__":
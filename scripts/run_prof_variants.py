@@ -6,11 +6,15 @@ Run rocprofv3 sys-trace across combinations of p, ub, and b.
 - ub and b values drawn from {512, 1024, 2048, 4096, 8192}
 - Constraints: b == p, ub == p
 - Output directory naming follows: ./prof_dir/p{p}_ub{ub}_b{b}_{YYYYMMDD_HHMMSS}
-- Logs are streamed to stdout and saved to {out_dir}/log.txt via tee
+- Logs (stdout and stderr of the run) are streamed to stdout and saved to {out_dir}/log.txt
+- If HIP_VISIBLE_DEVICES lists GPUs, combinations are spread across them: each GPU runs its
+  share one at a time, and the GPUs run in parallel. Otherwise combinations run one at a
+  time with the environment untouched, so each run sees all GPUs
 - Paths are relative to running from the repository root
 
 Usage:
   python3 scripts/run_prof_variants.py
+  HIP_VISIBLE_DEVICES=0,1,2,3 python3 scripts/run_prof_variants.py
 
 Notes:
   - Expects:
@@ -20,9 +24,14 @@ Notes:
 """
 import os
 import itertools
+import shlex
 import shutil
 import subprocess
+import sys
+import threading
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 # Parameter values
 P_VALUES = [2048, 4096, 8192]
@@ -35,23 +44,56 @@ BIN = "./build/bin/llama-bench"
 MODEL = "./models/Llama-3.1-8B-Instruct-BF16.gguf"
 RUN_TS = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_graph")
 
-def run_combo(p: int, ub: int, b: int) -> None:
-    """Run a single combination with rocprofv3 and tee the log."""
+# GPUs to run on; one profiling run per GPU at a time. None: a single worker that leaves
+# HIP_VISIBLE_DEVICES alone, so llama-bench sees (and splits across) every GPU
+GPU_IDS: List[Optional[str]] = [
+    g.strip() for g in os.environ.get("HIP_VISIBLE_DEVICES", "").split(",") if g.strip()
+] or [None]
+
+# Stop starting new runs once one has failed (runs already in progress finish). Runs killed by a
+# signal (e.g. Ctrl-C) always stop the sweep
+ABORT_ON_FAILURE = False
+
+def run_combo(p: int, ub: int, b: int, gpu_id: Optional[str]) -> int:
+    """Run a single combination with rocprofv3 on gpu_id (None: all GPUs), tee its output to log.txt, and return its exit code."""
     out_dir = os.path.join(BASE_DIR, f"{RUN_TS}/p{p}_ub{ub}_b{b}")
     os.makedirs(out_dir, exist_ok=True)
 
-    cmd = (
-        f"rocprofv3 --output-format csv --sys-trace -d {out_dir} -- "
-        f"{BIN} -m {MODEL} -r 1 -n 0 -p {p} -ub {ub} -b {b} "
-        f"| tee {out_dir}/log.txt"
-    )
+    cmd = [
+        "rocprofv3", "--output-format", "csv", "--sys-trace", "-d", out_dir, "--",
+        BIN, "-m", MODEL, "-r", "1", "-n", "0", "-p", str(p), "-ub", str(ub), "-b", str(b),
+    ]
+    env = None
+    if gpu_id is not None:
+        env = os.environ.copy()
+        env["HIP_VISIBLE_DEVICES"] = gpu_id
 
-    print(f"\n=== Running p={p}, ub={ub}, b={b} ===")
-    print(cmd)
-    # Use shell=True to support the `| tee` pipeline
-    result = subprocess.run(cmd, shell=True)
-    if result.returncode != 0:
-        print(f"WARNING: Command failed (exit {result.returncode}) for p={p}, ub={ub}, b={b}")
+    on_gpu = f" on GPU {gpu_id}" if gpu_id is not None else ""
+    print(f"\n=== Running p={p}, ub={ub}, b={b}{on_gpu} ===", flush=True)
+    print(shlex.join(cmd), flush=True)
+    prefix = f"[gpu {gpu_id}] ".encode() if len(GPU_IDS) > 1 else b""
+    # stderr is merged into stdout so log.txt has the full output, in order. Lines are copied as raw
+    # bytes, so output that is not valid UTF-8 cannot break the copy
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+    with open(os.path.join(out_dir, "log.txt"), "wb") as log_f:
+        for line in proc.stdout:
+            sys.stdout.buffer.write(prefix + line)
+            sys.stdout.buffer.flush()
+            log_f.write(line)
+    returncode = proc.wait()
+    if returncode != 0:
+        print(f"WARNING: Command failed (exit {returncode}) for p={p}, ub={ub}, b={b}", flush=True)
+    return returncode
+
+def run_combos_on_gpu(gpu_id: Optional[str], combos: List[Tuple[int, int, int]], abort: threading.Event) -> None:
+    """Run combos sequentially on a single GPU, stopping early once the sweep is aborted."""
+    for p, ub, b in combos:
+        if abort.is_set():
+            print(f"Skipping p={p}, ub={ub}, b={b}: sweep aborted", flush=True)
+            continue
+        returncode = run_combo(p, ub, b, gpu_id)
+        if returncode < 0 or (returncode != 0 and ABORT_ON_FAILURE):
+            abort.set()
 
 def main() -> None:
     # Basic pre-flight checks
@@ -65,11 +107,24 @@ def main() -> None:
         print("ERROR: 'rocprofv3' not found in PATH")
         return
 
-    # Iterate combinations; enforce constraint b <= p
+    # Collect combinations; enforce constraint b <= p
+    combos = []
     for p, ub, b in itertools.product(P_VALUES, UB_B_VALUES, UB_B_VALUES):
         if b > p or ub > p or ub > b or ub != p or b != ub:
             continue
-        run_combo(p, ub, b)
+        combos.append((p, ub, b))
+
+    # Round-robin the combinations over the GPUs; each GPU works through its share in order
+    shares = [combos[i::len(GPU_IDS)] for i in range(len(GPU_IDS))]
+    abort = threading.Event()
+    with ThreadPoolExecutor(max_workers=len(GPU_IDS)) as ex:
+        try:
+            list(ex.map(run_combos_on_gpu, GPU_IDS, shares, itertools.repeat(abort)))
+        except KeyboardInterrupt:
+            # Ctrl-C only reaches the main thread (the running children get SIGINT themselves);
+            # stop the workers from starting further runs before waiting for them to return
+            abort.set()
+            raise
 
 if __name__ == "__main__":
     main()